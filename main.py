@@ -1,14 +1,18 @@
 import os
-import json
+import re
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import zipfile
 import io
-import pandas as pd
-import xml.etree.ElementTree as ET
+import shutil
+import tempfile
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-from openai import OpenAI
-from bs4 import BeautifulSoup  # 추가된 라이브러리
 
 # --- 설정값 (GitHub Secrets) ---
 DART_API_KEY = os.environ.get("DART_API_KEY")
@@ -16,67 +20,197 @@ OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
 
+# 동시에 처리할 회사 수 (네트워크 대기가 대부분이므로 스레드로 병렬화)
+MAX_COMPANY_WORKERS = 8
+# 한 회사 안에서 동시에 분석할 공시 수
+MAX_ANALYSIS_WORKERS = 4
+
 # 파일 경로
 DATA_DIR = "data"
 COMPANIES_FILE = os.path.join(DATA_DIR, "companies.txt")
 CORP_CODE_FILE = os.path.join(DATA_DIR, "corp_codes.xml")
+CORP_CODE_INDEX_FILE = os.path.join(DATA_DIR, "corp_codes.json")
 STATE_FILE = os.path.join(DATA_DIR, "latest_filings.json")
+LLM_CACHE_DIR = os.path.join(DATA_DIR, "llm_cache")
+LIST_CACHE_FILE = os.path.join(DATA_DIR, "list_etag.json")
+
+# 공용 HTTP 세션 (keep-alive 로 DART/텔레그램 연결을 재사용)
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+))
+SESSION.headers["Accept-Encoding"] = "gzip"
 
 # --- 1. DART 고유번호 관리 ---
 def update_corp_code_file():
     url = "https://opendart.fss.or.kr/api/corpCode.xml"
     params = {'crtfc_key': DART_API_KEY}
     try:
-        response = requests.get(url, params=params)
+        response = SESSION.get(url, params=params)
         response.raise_for_status()
         with zipfile.ZipFile(io.BytesIO(response.content)) as z:
             z.extractall(DATA_DIR)
             extracted_name = z.namelist()[0]
             os.rename(os.path.join(DATA_DIR, extracted_name), CORP_CODE_FILE)
         print("고유번호 파일 업데이트 완료.")
+
+        # XML 이 바뀌었으므로 인덱스 캐시도 함께 갱신 (파싱에 성공한 경우에만 저장)
+        global _CORP_CODE_INDEX
+        index = parse_corp_code_xml()
+        if index is not None:
+            _CORP_CODE_INDEX = index
+            save_corp_code_index(index)
     except Exception as e:
         print(f"고유번호 다운로드 실패: {e}")
 
-def get_corp_code_from_file(target_corp_name):
+# 회사명 -> 고유번호 인덱스 (실행당 한 번만 구축)
+_CORP_CODE_INDEX = None
+
+def parse_corp_code_xml():
+    """
+    corp_codes.xml 을 스트리밍 파싱하여 {회사명: 고유번호} 딕셔너리를 생성합니다.
+    파싱 중 오류가 나면 일부만 채워진 인덱스 대신 None 을 반환합니다.
+    """
+    index = {}
     if not os.path.exists(CORP_CODE_FILE):
-        return None
+        return index
+    # 무거운 라이브러리는 실제로 필요할 때만 import (JSON 캐시가 있으면 lxml 을 읽지 않음)
+    from lxml import etree as ET
     try:
-        tree = ET.parse(CORP_CODE_FILE)
-        root = tree.getroot()
-        for corp_data in root.findall('list'):
-            if corp_data.find('corp_name').text.strip() == target_corp_name:
-                return corp_data.find('corp_code').text.strip()
+        for _, elem in ET.iterparse(CORP_CODE_FILE, events=('end',), tag='list', huge_tree=True):
+            name = elem.findtext('corp_name')
+            code = elem.findtext('corp_code')
+            if name and code:
+                # 동명 회사가 있으면 기존처럼 먼저 나온 항목을 사용
+                index.setdefault(name.strip(), code.strip())
+            # 처리한 요소는 비우고 트리에서 떼어내 메모리 사용량을 <list> 하나 수준으로 유지
+            # (tail 은 파서가 아직 채우는 중일 수 있으므로 건드리지 않음)
+            elem.clear(keep_tail=True)
+            parent = elem.getparent()
+            if parent is not None:
+                parent.remove(elem)
     except Exception as e:
         print(f"XML 파싱 에러: {e}")
-    return None
+        return None
+    return index
+
+def _corp_code_source_hash():
+    """인덱스 캐시 유효성 확인용 corp_codes.xml 의 SHA-256 (파싱보다 훨씬 빠름)"""
+    if not os.path.exists(CORP_CODE_FILE):
+        return None
+    digest = hashlib.sha256()
+    with open(CORP_CODE_FILE, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def save_corp_code_index(index):
+    if not index:
+        return
+    cache = {'source_sha256': _corp_code_source_hash(), 'index': index}
+    with open(CORP_CODE_INDEX_FILE, 'wb') as f:
+        f.write(orjson.dumps(cache))
+
+def build_corp_code_index():
+    """
+    고유번호 인덱스를 반환합니다.
+    XML 은 월 1회만 바뀌므로, 같은 XML 로 만든 JSON 캐시가 있으면 파싱 없이 바로 읽습니다.
+    (git checkout 은 수정 시각을 보존하지 않으므로 mtime 대신 XML 의 해시로 캐시 유효성을 확인)
+    """
+    if os.path.exists(CORP_CODE_INDEX_FILE):
+        try:
+            with open(CORP_CODE_INDEX_FILE, 'rb') as f:
+                cache = orjson.loads(f.read())
+            if cache.get('source_sha256') == _corp_code_source_hash():
+                return cache['index']
+        except Exception as e:
+            print(f"고유번호 캐시 로드 실패, XML 에서 다시 생성: {e}")
+
+    index = parse_corp_code_xml()
+    if index is None:
+        # 불완전한 인덱스는 캐시에 남기지 않음 (다음 실행에서 다시 파싱)
+        return {}
+    save_corp_code_index(index)
+    return index
+
+def _get_index():
+    global _CORP_CODE_INDEX
+    if _CORP_CODE_INDEX is None:
+        _CORP_CODE_INDEX = build_corp_code_index()
+    return _CORP_CODE_INDEX
+
+def get_corp_code_from_file(target_corp_name):
+    # 인덱스(JSON 캐시는 같은 XML 로 만든 것만 사용)에 없으면 XML 에도 없는 회사
+    return _get_index().get(target_corp_name)
 
 # --- 2. 공시 본문 추출 (추가된 기능) ---
-def clean_html_for_ai(html_content):
-    """HTML/XML 태그 제거 및 텍스트 정제"""
-    try:
-        """
-        HTML/XML 태그를 제거하고 AI가 구조를 파악하기 쉽게 텍스트를 정리합니다.
-        """
-        soup = BeautifulSoup(html_content, 'lxml') # lxml 파서가 빠르고 강력함
+# AI 에 넘길 본문 최대 길이 (AI 모델의 Context Window 고려)
+MAX_CONTENT_LENGTH = 15000
+_PARSE_CHUNK_SIZE = 64 * 1024
+
+_SKIP_TAGS = {"script", "style", "head", "meta", "noscript"}
+_MULTI_SPACE_RE = re.compile(r'[ \t\u00a0]{2,}')
+_BLANK_LINES_RE = re.compile(r'[ \t\u00a0]*\n\s*')
+
+class _TextCollector:
+    """lxml 파서 타깃: 트리를 만들지 않고 본문 텍스트만 순서대로 모음"""
+
+    def __init__(self):
+        self.parts = []
+        # 공백을 제외한 글자 수 (공백 정리 후 길이의 하한이므로 파싱 중단 기준으로 사용)
+        self.size = 0
+        self._skip_depth = 0
 
-        # 1. 불필요한 태그 제거 (Script, Style, 숨겨진 요소 등)
-        for script in soup(["script", "style", "head", "meta", "noscript"]):
-            script.extract()
+    def start(self, tag, attrib):
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+        # 태그 경계마다 줄바꿈을 넣어 표의 셀 등이 서로 붙지 않도록 함
+        self.parts.append("\n")
 
-        # 2. 표(Table) 처리 - AI에게 표는 매우 중요하므로 구조를 보존해야 함
-        # 간단히 텍스트를 탭이나 파이프(|)로 구분하여 Markdown 표처럼 보이게 변환 시도
-        # (복잡한 표는 별도 로직이 필요할 수 있으나, 일반적인 텍스트 추출 방식 적용)
+    def end(self, tag):
+        if tag in _SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        self.parts.append("\n")
 
-        # 3. 텍스트 추출 (get_text 사용 시 separator를 줄바꿈으로 지정)
-        text = soup.get_text(separator="\n\n")
+    def data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+            self.size += sum(map(len, data.split()))
 
-        # 4. 공백 정리 (연속된 줄바꿈 제거 등)
+    def close(self):
+        return "".join(self.parts)
+
+def clean_html_for_ai(html_content, max_length=None):
+    """
+    HTML/XML 태그를 제거하고 AI가 구조를 파악하기 쉽게 텍스트를 정리합니다.
+    공백을 제외하고 max_length 자를 넘는 텍스트가 모이면 나머지 원문은 파싱하지 않고 중단합니다.
+    """
+    from lxml import etree as ET
+    try:
+        # 문자열/bytes 와 파일 객체(압축 해제 스트림)를 모두 받음
+        if isinstance(html_content, str):
+            html_content = html_content.encode('utf-8')
+        if isinstance(html_content, bytes):
+            html_content = io.BytesIO(html_content)
+
+        # 1. 원문을 조금씩 파서에 넣으며 텍스트 추출 (Script, Style 등 내부 텍스트는 제외)
+        collector = _TextCollector()
+        parser = ET.HTMLParser(target=collector, encoding='utf-8')
+        while max_length is None or collector.size <= max_length:
+            chunk = html_content.read(_PARSE_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+        text = parser.close()
+
+        # 2. 공백 정리 (연속된 공백/빈 줄 제거)
         # 문장 사이의 과도한 공백은 Token 낭비의 주범입니다.
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = '\n'.join(chunk for chunk in chunks if chunk)
+        text = _MULTI_SPACE_RE.sub(' ', text)
+        text = _BLANK_LINES_RE.sub('\n', text)
 
-        return text
+        return text.strip()
     except Exception as e:
         return f"텍스트 정제 중 오류: {e}"
 
@@ -96,12 +230,17 @@ def fetch_and_extract_dart_content(crtfc_key, rcept_no):
 
     try:
         # 2. 파일 다운로드 (Stream 방식)
-        response = requests.get(api_url, params=params)
-        response.raise_for_status() # 에러 발생 시 중단
+        # 본문을 한 번에 메모리에 올리지 않고, 4MB 까지는 메모리 / 그 이상은 임시 파일에 버퍼링
+        buf = tempfile.SpooledTemporaryFile(max_size=4 << 20)
+        with SESSION.get(api_url, params=params, stream=True) as response:
+            response.raise_for_status() # 에러 발생 시 중단
+            response.raw.decode_content = True
+            shutil.copyfileobj(response.raw, buf)
+        buf.seek(0)
 
-        # 3. ZIP 파일 처리 (디스크 저장 없이 메모리에서 바로 해제)
+        # 3. ZIP 파일 처리
         # DART document.xml API는 항상 ZIP 파일을 반환합니다.
-        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
+        with buf, zipfile.ZipFile(buf) as z:
             # 압축 파일 내의 파일 목록 확인
             file_list = z.namelist()
             print(f"📦 압축 파일 내 파일 목록: {file_list}")
@@ -109,13 +248,12 @@ def fetch_and_extract_dart_content(crtfc_key, rcept_no):
             # 보통 첫 번째 파일이 주된 공시 문서입니다. (혹은 .xml로 끝나는 파일 찾기)
             xml_filename = [f for f in file_list if f.endswith('.xml')][0]
 
-            with z.open(xml_filename) as f:
-                xml_content = f.read().decode('utf-8') # 한글 디코딩
-
-        print("✅ 다운로드 및 압축 해제 완료. 텍스트 정제 시작...")
+            print("✅ 다운로드 완료. 압축 해제하며 텍스트 정제 시작...")
 
-        # 4. 텍스트 정제 (AI Input 최적화)
-        clean_text = clean_html_for_ai(xml_content)
+            # 4. 텍스트 정제 (AI Input 최적화)
+            # 압축 해제 스트림을 파서에 바로 넘기고, 분석에 필요한 만큼만 읽고 중단
+            with z.open(xml_filename) as f:
+                clean_text = clean_html_for_ai(f, max_length=MAX_CONTENT_LENGTH)
 
         return clean_text
 
@@ -127,6 +265,30 @@ def fetch_and_extract_dart_content(crtfc_key, rcept_no):
         return f"❌ 알 수 없는 오류 발생: {e}"
 
 # --- 3. 공시 검색 및 AI 분석 ---
+# 회사별 마지막 공시 목록 응답 {corp_code: {etag, last_modified, body_sha, rows}}
+_LIST_CACHE = None
+_LIST_CACHE_LOCK = threading.Lock()
+
+def _list_cache():
+    global _LIST_CACHE
+    with _LIST_CACHE_LOCK:
+        if _LIST_CACHE is None:
+            _LIST_CACHE = {}
+            if os.path.exists(LIST_CACHE_FILE):
+                try:
+                    with open(LIST_CACHE_FILE, 'rb') as f:
+                        _LIST_CACHE = orjson.loads(f.read())
+                except Exception as e:
+                    print(f"공시 목록 캐시 로드 실패: {e}")
+        return _LIST_CACHE
+
+def save_list_cache():
+    if _LIST_CACHE is None:
+        return
+    with _LIST_CACHE_LOCK:
+        with open(LIST_CACHE_FILE, 'wb') as f:
+            f.write(orjson.dumps(_LIST_CACHE))
+
 def get_recent_filings(corp_code):
     dt_end = datetime.now()
     dt_start = dt_end - relativedelta(days=7)
@@ -140,30 +302,121 @@ def get_recent_filings(corp_code):
         'page_count': 50
     }
     
-    res = requests.get(url, params=params)
-    data = res.json()
+    # 지난 응답의 ETag/Last-Modified 로 조건부 요청 (변경 없으면 지난 목록을 그대로 사용)
+    cached = _list_cache().get(corp_code)
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    res = SESSION.get(url, params=params, headers=headers)
+    if cached and res.status_code == 304:
+        return cached['rows']
+
+    # 서버가 조건부 요청을 지원하지 않아도, 본문이 지난번과 같으면 파싱을 생략
+    body_sha = hashlib.sha256(res.content).hexdigest()
+    if cached and cached.get('body_sha') == body_sha:
+        return cached['rows']
+
+    data = orjson.loads(res.content)
     
     if data.get('status') == '000':
-        df = pd.DataFrame(data.get('list', []))
-        df['rcept_dt'] = pd.to_datetime(df['rcept_dt'])
-        df = df.sort_values(by='rcept_no', ascending=True)
-        return df
-    return pd.DataFrame()
+        # 접수번호는 0으로 채워진 14자리 숫자 문자열이므로 문자열 순서 = 접수 순서
+        rows = sorted(data.get('list', []), key=lambda r: r['rcept_no'])
+        with _LIST_CACHE_LOCK:
+            _LIST_CACHE[corp_code] = {
+                'etag': res.headers.get('ETag'),
+                'last_modified': res.headers.get('Last-Modified'),
+                'body_sha': body_sha,
+                'rows': rows,
+            }
+        return rows
+    return []
+
+# OpenRouter 클라이언트 (공시마다 새로 만들지 않고 연결을 재사용)
+_OPENAI_CLIENT = None
+_OPENAI_CLIENT_LOCK = threading.Lock()
+
+def _client():
+    global _OPENAI_CLIENT
+    # 여러 작업자가 동시에 첫 분석을 시작해도 클라이언트는 하나만 생성
+    with _OPENAI_CLIENT_LOCK:
+        if _OPENAI_CLIENT is None:
+            # openai 는 httpx/pydantic 까지 불러오므로 새 공시를 분석할 때만 import
+            from openai import OpenAI
+            _OPENAI_CLIENT = OpenAI(
+                base_url="https://openrouter.ai/api/v1",
+                api_key=OPENROUTER_API_KEY,
+            )
+        return _OPENAI_CLIENT
+
+def llm_call(model, messages, **kwargs):
+    """
+    LLM 응답을 (model, messages) 해시 기준으로 디스크에 캐시합니다.
+    같은 공시를 다시 처리해도 API 를 재호출하지 않습니다.
+    """
+    key = hashlib.sha256(
+        orjson.dumps({"model": model, "messages": messages}, option=orjson.OPT_SORT_KEYS)
+    ).hexdigest()
+    cache_path = os.path.join(LLM_CACHE_DIR, f"{key}.json")
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                return orjson.loads(f.read())['content']
+        except Exception as e:
+            print(f"LLM 캐시 읽기 실패: {e}")
+
+    completion = _client().chat.completions.create(model=model, messages=messages, **kwargs)
+    content = completion.choices[0].message.content
+
+    os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+    with open(cache_path, 'wb') as f:
+        f.write(orjson.dumps({"model": model, "content": content}))
+    return content
+
+# 제목만으로 성격이 정해지는 정형 공시 (본문 다운로드/LLM 호출 없이 바로 분류)
+# (패턴, 판단, 요약) - 비슷한 제목의 다른 공시(결과보고서, 신탁계약 해지, 자회사 공시 등)와 섞이지 않도록 결정 공시 제목까지 맞춤
+# 지분 변동 보고서(임원ㆍ주요주주, 대량보유, 최대주주 변동)는 변동 방향/목적에 따라 영향이 달라지므로 AI 가 본문을 판단
+REPORT_RULES = [
+    (r"기업설명회\(IR\)개최", "중립", "기업설명회(IR) 개최 일정을 안내하는 공시입니다."),
+    (r"자기주식취득결정(?!\(자회사)", "호재", "회사가 자기주식을 취득하기로 결정한 공시로, 주주환원 성격을 가집니다."),
+    (r"현금[ㆍ·]현물배당결정(?!\(자회사)", "호재", "배당 지급을 결정한 공시로, 주주환원 성격을 가집니다."),
+]
+
+# 모든 규칙을 하나의 정규식으로 미리 컴파일 (제목당 한 번의 검색으로 판별)
+_REPORT_RULES_RE = re.compile(
+    "|".join(f"(?P<r{i}>{pattern})" for i, (pattern, _, _) in enumerate(REPORT_RULES))
+)
+
+def triage_report(report_nm):
+    """정형 공시이면 규칙 기반 분석 결과를, 아니면 None 을 반환"""
+    m = _REPORT_RULES_RE.search(report_nm)
+    if not m:
+        return None
+    _, verdict, summary = REPORT_RULES[int(m.lastgroup[1:])]
+    return (
+        f"1. 요약: {summary}\n"
+        f"2. 주가 영향: {verdict} - 제목만으로 성격이 정해지는 정형 공시 유형입니다.\n"
+        "3. 유의사항: 세부 수치와 조건은 원문 링크에서 확인하세요.\n"
+        "(제목 기반 자동 분류)"
+    )
 
 def analyze_content(row):
     """공시 본문을 가져와 AI에게 분석 요청"""
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=OPENROUTER_API_KEY,
-    )
-    
+    # 0. 정형 공시는 규칙으로 바로 분류
+    triaged = triage_report(row['report_nm'])
+    if triaged:
+        return triaged
+
     # 1. 본문 텍스트 추출
     raw_content = fetch_and_extract_dart_content(DART_API_KEY, row['rcept_no'])
     
     # 2. 텍스트 길이 제한 (AI 모델의 Context Window 고려, 약 15,000자 제한)
-    max_length = 15000
-    if len(raw_content) > max_length:
-        content_to_analyze = raw_content[:max_length] + "\n...(내용이 너무 길어 생략됨)"
+    if len(raw_content) > MAX_CONTENT_LENGTH:
+        content_to_analyze = raw_content[:MAX_CONTENT_LENGTH] + "\n...(내용이 너무 길어 생략됨)"
     else:
         content_to_analyze = raw_content
 
@@ -187,29 +440,143 @@ def analyze_content(row):
     )
 
     try:
-        completion = client.chat.completions.create(
-            extra_headers={"HTTP-Referer": "https://github.com", "X-Title": "DartBot"},
+        return llm_call(
             model="xiaomi/mimo-v2-flash:free",
             messages=[
                 {"role": "system", "content": "핵심만 간결하게 전달하는 금융 전문가입니다."},
                 {"role": "user", "content": prompt_text}
-            ]
+            ],
+            extra_headers={"HTTP-Referer": "https://github.com", "X-Title": "DartBot"},
         )
-        return completion.choices[0].message.content
     except Exception as e:
         return f"AI 분석 실패: {e}"
 
 # --- 4. 텔레그램 전송 ---
-def send_telegram(message):
+TELEGRAM_MAX_LENGTH = 4096
+TELEGRAM_SEPARATOR = "\n\n---\n\n"
+
+# 공시 알림 메시지 형식 (row 의 corp_name/report_nm/rcept_no 와 AI 분석 결과로 채움)
+MSG_TEMPLATE = (
+    "🚨 *DART 알림: {corp_name}*\n"
+    "📄 {report_nm}\n"
+    "🔗 [링크 보기](http://dart.fss.or.kr/dsaf001/main.do?rcpNo={rcept_no})\n\n"
+    "📝 *AI 분석 보고서:*\n{ai}"
+)
+
+TRUNCATED_SUFFIX = "\n...(메시지가 너무 길어 생략됨)"
+
+def format_filing_message(row, ai_result):
+    """
+    공시 알림 메시지를 만듭니다.
+    길이 제한을 넘으면 템플릿의 Markdown(굵게/링크)이 잘리지 않도록 AI 분석 결과 쪽만 줄입니다.
+    """
+    msg = MSG_TEMPLATE.format_map({**row, 'ai': ai_result})
+    overflow = len(msg) - TELEGRAM_MAX_LENGTH
+    if overflow > 0:
+        ai_result = ai_result[:max(len(ai_result) - overflow - len(TRUNCATED_SUFFIX), 0)] + TRUNCATED_SUFFIX
+        msg = MSG_TEMPLATE.format_map({**row, 'ai': ai_result})
+    return msg
+
+def _post_telegram(payload):
+    """전송 결과를 True(성공) / False(다시 시도할 실패) / None(Markdown 파싱 오류로 거부됨) 으로 반환"""
     url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {'chat_id': TELEGRAM_CHAT_ID, 'text': message, 'parse_mode': 'Markdown'}
-    requests.post(url, data=payload)
+    try:
+        res = SESSION.post(url, data=payload)
+    except requests.exceptions.RequestException as e:
+        print(f"텔레그램 전송 실패: {e}")
+        return False
+    if res.ok:
+        return True
+    print(f"텔레그램 전송 실패: {res.status_code} {res.text}")
+    # Markdown 파싱 오류만 메시지 내용 문제로 봄 (다시 보내도 같은 결과)
+    # 그 외(chat not found 등 400 포함, 401/403/404, 429/5xx)는 설정/일시적 문제이므로 상태를 유지하고 재시도
+    try:
+        description = orjson.loads(res.content).get('description', '')
+    except Exception:
+        description = ''
+    if res.status_code == 400 and "can't parse entities" in description:
+        return None
+    return False
+
+def send_telegram(message):
+    """
+    메시지를 전송하고, 다음 실행에서 다시 보내야 하면 False 를 반환합니다.
+    Markdown 파싱 오류로 거부된 메시지는 일반 텍스트로 다시 보내고, 그래도 거부되면 건너뜁니다.
+    """
+    result = _post_telegram({'chat_id': TELEGRAM_CHAT_ID, 'text': message, 'parse_mode': 'Markdown'})
+    if result is None:
+        result = _post_telegram({'chat_id': TELEGRAM_CHAT_ID, 'text': message})
+    if result is None:
+        print("텔레그램이 메시지 형식을 거부하여 건너뜁니다.")
+        return True
+    return result
+
+def pack_telegram_messages(blocks):
+    """
+    (본문, 접수번호) 목록을 텔레그램 길이 제한에 맞춰 묶습니다.
+    각 묶음의 (메시지, 묶음 내 마지막 접수번호) 목록을 반환합니다.
+    """
+    batches = []
+    current, last_rcept_no = "", None
+    for text, rcept_no in blocks:
+        if current and len(current) + len(TELEGRAM_SEPARATOR) + len(text) > TELEGRAM_MAX_LENGTH:
+            batches.append((current, last_rcept_no))
+            current = ""
+        current = current + TELEGRAM_SEPARATOR + text if current else text
+        last_rcept_no = rcept_no
+    if current:
+        batches.append((current, last_rcept_no))
+    return batches
 
 # --- 메인 실행부 ---
+def process_company(corp_name, state, on_sent):
+    """회사 하나의 새 공시를 분석하여 묶어서 전송하고, 전송될 때마다 on_sent 로 접수번호를 알림"""
+    print(f"[{corp_name}] 검색 시작...")
+
+    code = get_corp_code_from_file(corp_name)
+    if not code:
+        print(f" -> [{corp_name}] 고유번호 없음.")
+        return
+
+    rows = get_recent_filings(code)
+    if not rows:
+        return
+
+    last_rcept_no = state.get(corp_name, "00000000000000")
+    new_filings = [r for r in rows if r['rcept_no'] > last_rcept_no]
+
+    if not new_filings:
+        print(f" -> [{corp_name}] 새로운 공시 없음")
+        return
+
+    for row in new_filings:
+        print(f" -> [{corp_name}] 새 공시 분석 중: {row['report_nm']}")
+
+    # 공시별 본문 다운로드/AI 분석은 서로 독립적이므로 동시에 처리 (결과는 원래 순서 유지)
+    with ThreadPoolExecutor(max_workers=MAX_ANALYSIS_WORKERS) as ex:
+        ai_results = list(ex.map(analyze_content, new_filings))
+
+    blocks = []
+    for row, ai_result in zip(new_filings, ai_results):
+        blocks.append((format_filing_message(row, ai_result), row['rcept_no']))
+
+    # 회사별 새 공시를 한 메시지로 묶어 전송 (일시적 오류로 실패하면 이후 묶음은 다음 실행에서 재시도)
+    for message, rcept_no in pack_telegram_messages(blocks):
+        if not send_telegram(message):
+            break
+        on_sent(corp_name, rcept_no)
+
+def save_state(state):
+    """임시 파일에 쓴 뒤 교체하여, 저장 중 중단되어도 상태 파일이 깨지지 않도록 함"""
+    tmp_file = STATE_FILE + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(orjson.dumps(state, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    os.replace(tmp_file, STATE_FILE)
+
 def main():
     if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, 'r', encoding='utf-8') as f:
-            state = json.load(f)
+        with open(STATE_FILE, 'rb') as f:
+            state = orjson.loads(f.read())
     else:
         state = {}
 
@@ -220,44 +587,23 @@ def main():
     with open(COMPANIES_FILE, 'r', encoding='utf-8') as f:
         companies = [line.strip() for line in f if line.strip()]
 
-    updated_state = state.copy()
-    
-    for corp_name in companies:
-        print(f"[{corp_name}] 검색 시작...")
-        
-        code = get_corp_code_from_file(corp_name)
-        if not code:
-            print(f" -> 고유번호 없음.")
-            continue
-            
-        df = get_recent_filings(code)
-        if df.empty:
-            continue
-            
-        last_rcept_no = state.get(corp_name, "00000000000000")
-        new_filings = df[df['rcept_no'] > last_rcept_no]
-        
-        if new_filings.empty:
-            print(" -> 새로운 공시 없음")
-            continue
-            
-        for _, row in new_filings.iterrows():
-            print(f" -> 새 공시 분석 중: {row['report_nm']}")
-            
-            ai_result = analyze_content(row)
-            
-            msg = (
-                f"🚨 *DART 알림: {row['corp_name']}*\n"
-                f"📄 {row['report_nm']}\n"
-                f"🔗 [링크 보기](http://dart.fss.or.kr/dsaf001/main.do?rcpNo={row['rcept_no']})\n\n"
-                f"📝 *AI 분석 보고서:*\n{ai_result}"
-            )
-            
-            send_telegram(msg)
-            updated_state[corp_name] = row['rcept_no']
+    state_lock = threading.Lock()
+
+    def on_sent(corp_name, rcept_no):
+        # 전송에 성공할 때마다 바로 저장하여 중간에 실패해도 진행 상황을 잃지 않음
+        # (각 회사의 항목은 그 회사를 처리하는 작업자만 쓰므로 state 를 직접 갱신)
+        with state_lock:
+            state[corp_name] = rcept_no
+            save_state(state)
+
+    # 고유번호 인덱스는 작업자들이 공유하므로 미리 한 번 구축
+    _get_index()
+
+    # 회사별 작업은 서로 독립적인 네트워크 I/O이므로 동시에 처리
+    with ThreadPoolExecutor(max_workers=MAX_COMPANY_WORKERS) as ex:
+        list(ex.map(lambda name: process_company(name, state, on_sent), companies))
 
-    with open(STATE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(updated_state, f, ensure_ascii=False, indent=4)
+    save_list_cache()
 
 if __name__ == "__main__":
     if not os.path.exists(CORP_CODE_FILE):